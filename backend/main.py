@@ -1,7 +1,13 @@
 import os
+import sys
 import asyncio
+import threading
+import tracemalloc
+import hmac
+from collections import OrderedDict
 import requests
-from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Body, Depends, Header, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict, Any, List
 import boto3
@@ -20,6 +26,7 @@ from botocore.credentials import Credentials
 import aiohttp
 import logging
 import traceback
+from difflib import SequenceMatcher
 import io
 from PyPDF2 import PdfReader
 
@@ -98,6 +105,41 @@ bedrock_runtime = session.client(
     aws_secret_access_key=AWS_SECRET_KEY,
 )
 
+# Live transcript delivery config
+# Clients opt into delta-encoded partials by connecting with ?protocol=2
+TRANSCRIPT_PROTOCOL_VERSION = 2
+PARTIAL_TRANSCRIPT_MAX_RATE = float(os.getenv('PARTIAL_TRANSCRIPT_MAX_RATE', '10'))  # partial updates per second, per session
+WS_PER_MESSAGE_DEFLATE = os.getenv('WS_PER_MESSAGE_DEFLATE', 'true').lower() == 'true'
+
+# Session management config for /ws/transcribe
+MAX_TRANSCRIBE_SESSIONS = int(os.getenv('MAX_TRANSCRIBE_SESSIONS', '50'))
+SESSION_MAX_LOOP_LAG = float(os.getenv('SESSION_MAX_LOOP_LAG', '0.5'))  # seconds of event loop lag before new sessions are refused
+SESSION_AUDIO_QUEUE_SIZE = int(os.getenv('SESSION_AUDIO_QUEUE_SIZE', '64'))  # audio chunks buffered per session
+SESSION_OUTBOUND_QUEUE_SIZE = int(os.getenv('SESSION_OUTBOUND_QUEUE_SIZE', '128'))  # messages buffered per session
+SESSION_HEARTBEAT_INTERVAL = float(os.getenv('SESSION_HEARTBEAT_INTERVAL', '15'))
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '60'))
+SESSION_DRAIN_TIMEOUT = float(os.getenv('SESSION_DRAIN_TIMEOUT', '25'))
+
+# Speculative assistance config
+# When enabled, knowledge base retrieval starts once a partial transcript has been stable for a while
+SPECULATIVE_ASSISTANCE = os.getenv('SPECULATIVE_ASSISTANCE', 'false').lower() == 'true'
+SPECULATIVE_STABLE_MS = float(os.getenv('SPECULATIVE_STABLE_MS', '300'))  # how long leading words must be unchanged
+SPECULATIVE_MIN_WORDS = int(os.getenv('SPECULATIVE_MIN_WORDS', '3'))
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv('SPECULATIVE_MATCH_THRESHOLD', '0.8'))  # similarity below which the prepared prompt is rebuilt
+SPECULATIVE_PREPARE_PROMPT = os.getenv('SPECULATIVE_PREPARE_PROMPT', 'false').lower() == 'true'
+
+# Profiling config (admin only, off by default)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_ADMIN_TOKEN = os.getenv('PROFILING_ADMIN_TOKEN')  # sent as the X-Admin-Token header
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILING_SAMPLE_INTERVAL_MS', '5'))
+PROFILING_MAX_SECONDS = float(os.getenv('PROFILING_MAX_SECONDS', '60'))
+PROFILING_MAX_STORED = int(os.getenv('PROFILING_MAX_STORED', '20'))
+
+# WebSocket close codes
+WS_CLOSE_NORMAL = 1000
+WS_CLOSE_GOING_AWAY = 1001
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
 def extract_text_from_pdf(pdf_content):
     """Extract text from PDF content"""
     try:
@@ -363,21 +405,470 @@ async def get_analysis():
         print(f"Unexpected error fetching analysis: {str(e)}")  # Debug log
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+class PartialTranscriptCoalescer:
+    """
+    Coalesces transcript results for a single websocket session.
+
+    Partial results are sent at most PARTIAL_TRANSCRIPT_MAX_RATE times per second;
+    a partial that arrives too early is held back and only the latest one is sent.
+    A final result drops any partial still waiting to be sent.
+
+    Protocol 1 clients receive the full text of every update. Protocol 2 clients
+    receive only the changed suffix, the offset it replaces from and a revision
+    number for the current segment (utterance).
+
+    `send` is a coroutine taking (message, droppable) and returning whether the
+    message was queued; partials are droppable, so deltas are always computed
+    against the last partial that was actually queued.
+    """
+
+    def __init__(self, send, protocol_version: int = 1, max_rate: float = PARTIAL_TRANSCRIPT_MAX_RATE, name: str = None):
+        self.send = send
+        self.name = name
+        self.protocol_version = protocol_version
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.segment = 0
+        self.revision = 0
+        self.sent_text = ""
+        self.pending_text = None
+        self.last_sent_at = 0.0
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    async def add(self, text: str, is_final: bool):
+        async with self.lock:
+            if is_final:
+                # The final supersedes whatever partial is still pending
+                self.pending_text = None
+                await self._send(text, True)
+                self.segment += 1
+                self.revision = 0
+                self.sent_text = ""
+                return
+
+            if text == self.sent_text:
+                self.pending_text = None
+                return
+
+            wait = self.min_interval - (time.monotonic() - self.last_sent_at)
+            if wait <= 0 and self.pending_text is None:
+                await self._send(text, False)
+                return
+
+            self.pending_text = text
+            if self.flush_task is None or self.flush_task.done():
+                self.flush_task = asyncio.create_task(
+                    self._flush_later(max(wait, 0.0)),
+                    name=f"{self.name}:flush_partial" if self.name else None
+                )
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        async with self.lock:
+            if self.pending_text is not None:
+                text, self.pending_text = self.pending_text, None
+                await self._send(text, False)
+
+    async def _send(self, text: str, is_final: bool):
+        if self.protocol_version >= 2:
+            offset = len(os.path.commonprefix([self.sent_text, text]))
+            message = {
+                "type": "transcript_delta",
+                "data": {
+                    "segment": self.segment,
+                    "revision": self.revision + 1,
+                    "offset": offset,
+                    "text": text[offset:],
+                    "is_final": is_final
+                }
+            }
+        else:
+            message = {
+                "type": "transcript",
+                "data": {
+                    "text": text,
+                    "is_final": is_final
+                }
+            }
+
+        if not await self.send(message, droppable=not is_final):
+            logger.debug(f"Dropped partial transcript (segment={self.segment}), outbound queue full")
+            return
+        self.revision += 1
+        self.sent_text = text
+        self.last_sent_at = time.monotonic()
+
+        if is_final:
+            logger.info(f"Sent transcript (is_final=True): {text}")
+        else:
+            logger.debug(f"Sent partial transcript (segment={self.segment}, revision={self.revision})")
+
+    def close(self):
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+
+# Aggregate speculation counters across sessions, reported by /api/debug/speculation
+speculation_stats = {
+    "started": 0,
+    "prompt_refreshes": 0,
+    "hits": 0,
+    "misses": 0,
+    "close_matches": 0,
+    "prompt_hits": 0,
+    "finals_without_speculation": 0,
+    "time_saved": 0.0
+}
+
+class SpeculativeAssistance:
+    """
+    Starts assistance work for a session before Transcribe marks a result final.
+
+    Words of the current partial are timestamped when first seen at their position.
+    Once at least SPECULATIVE_MIN_WORDS leading words have been unchanged for
+    SPECULATIVE_STABLE_MS, the knowledge base context is fetched. Retrieval reads the
+    whole knowledge base regardless of the question, so one fetch per segment is
+    started and its context is always reused for the final. As the stable text moves
+    on, only the prompt (with SPECULATIVE_PREPARE_PROMPT) is rebuilt, and it is reused
+    only when built for exactly the final text. SPECULATIVE_MATCH_THRESHOLD decides
+    when the stable text has drifted far enough to rebuild the prompt, and is reported
+    as close_matches.
+    """
+
+    def __init__(self, enabled: bool = SPECULATIVE_ASSISTANCE, name: str = None):
+        self.enabled = enabled
+        self.name = name
+        self.stable_seconds = SPECULATIVE_STABLE_MS / 1000
+        self.words = []  # (word, first_seen) for the current partial
+        self.text = None  # stable text the current speculation is for
+        self.fetch = None  # in-flight or finished context fetch for this segment
+        self.prompt_text = None
+        self.prompt = None
+        self.check_handle = None
+
+    def observe_partial(self, text: str):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        words = text.split()
+
+        # Keep first-seen times for the unchanged leading words
+        unchanged = 0
+        while unchanged < min(len(words), len(self.words)) and words[unchanged] == self.words[unchanged][0]:
+            unchanged += 1
+        self.words = self.words[:unchanged] + [(word, now) for word in words[unchanged:]]
+
+        self._check_stable()
+
+        # Partials stop arriving when the speaker pauses, so check again once the newest words settle
+        if self.check_handle is not None:
+            self.check_handle.cancel()
+        self.check_handle = asyncio.get_running_loop().call_later(self.stable_seconds, self._check_stable)
+
+    def _check_stable(self):
+        cutoff = time.monotonic() - self.stable_seconds
+        stable = 0
+        while stable < len(self.words) and self.words[stable][1] <= cutoff:
+            stable += 1
+        if stable < SPECULATIVE_MIN_WORDS:
+            return
+
+        stable_text = " ".join(word for word, _ in self.words[:stable])
+        if stable_text == self.text:
+            return
+        # Follow small drifts only once the whole partial has settled (a pause), which is
+        # when the final usually arrives; this bounds how often the prompt is rebuilt
+        settled = stable == len(self.words)
+        if not settled and self.text is not None and SequenceMatcher(None, self.text, stable_text).ratio() >= SPECULATIVE_MATCH_THRESHOLD:
+            return
+        self.text = stable_text
+
+        # The context does not depend on the text, so fetch it once per segment
+        if self.fetch is None:
+            fetch = {"started_at": time.monotonic(), "finished_at": None}
+            fetch["task"] = asyncio.create_task(
+                self._fetch_context(fetch),
+                name=f"{self.name}:speculation" if self.name else None
+            )
+            self.fetch = fetch
+            speculation_stats["started"] += 1
+            logger.debug(f"Started speculative retrieval for: {stable_text}")
+        elif self.fetch["task"].done():
+            self._prepare_prompt()
+
+    async def _fetch_context(self, fetch: Dict[str, Any]):
+        try:
+            context = await fetch_assistance_context()
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed: {str(e)}")
+            return None
+        fetch["finished_at"] = time.monotonic()
+        if self.fetch is fetch:
+            self._prepare_prompt(context)
+        return context
+
+    def _prepare_prompt(self, context: str = None):
+        if not SPECULATIVE_PREPARE_PROMPT or self.text == self.prompt_text:
+            return
+        if context is None:
+            context = self.fetch["task"].result()
+        if context is None or not context.strip():
+            return
+        if self.prompt_text is not None:
+            speculation_stats["prompt_refreshes"] += 1
+        self.prompt_text = self.text
+        self.prompt = build_assistance_prompt(context, self.text)
+
+    def _reset(self):
+        self.words = []
+        self.text = None
+        self.fetch = None
+        self.prompt_text = None
+        self.prompt = None
+        if self.check_handle is not None:
+            self.check_handle.cancel()
+            self.check_handle = None
+
+    async def take(self, final_text: str) -> Dict[str, str]:
+        """
+        Returns keyword arguments for get_bedrock_assistance: the speculative context
+        (and prompt, if it was built for exactly this text), or nothing if the fetch failed.
+        """
+        if not self.enabled:
+            return {}
+        final_at = time.monotonic()
+        text, fetch, prompt_text, prompt = self.text, self.fetch, self.prompt_text, self.prompt
+        self._reset()
+
+        if fetch is None:
+            speculation_stats["finals_without_speculation"] += 1
+            return {}
+
+        similarity = SequenceMatcher(None, text, final_text).ratio()
+        if similarity >= SPECULATIVE_MATCH_THRESHOLD:
+            speculation_stats["close_matches"] += 1
+
+        context = await fetch["task"]
+        if context is None:
+            speculation_stats["misses"] += 1
+            return {}
+
+        # Only the work done before the final arrived was actually saved
+        time_saved = min(fetch["finished_at"], final_at) - fetch["started_at"]
+        speculation_stats["hits"] += 1
+        speculation_stats["time_saved"] += time_saved
+        logger.debug(f"Reused speculation (similarity={similarity:.2f}, saved {time_saved * 1000:.0f}ms)")
+
+        prepared = {"context": context}
+        if prompt is not None and prompt_text == final_text:
+            prepared["prompt"] = prompt
+            speculation_stats["prompt_hits"] += 1
+        return prepared
+
+    def close(self):
+        if self.fetch is not None:
+            self.fetch["task"].cancel()
+        self._reset()
+
+class TranscribeSession:
+    """
+    State for one /ws/transcribe connection.
+
+    Audio from the client is buffered in a bounded queue before it is forwarded to
+    Transcribe; when the queue is full the oldest chunk is dropped so latency stays
+    bounded instead of growing with a slow upstream. Messages to the client go through
+    a bounded outbound queue; droppable messages (partials, heartbeats) are discarded
+    when it is full, while finals and assistance wait for room.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.id = str(uuid.uuid4())
+        self.task = asyncio.current_task()
+        self.started_at = time.monotonic()
+        self.conversation_data = {
+            "id": self.id,
+            "timestamp": datetime.now().isoformat(),
+            "transcript": []
+        }
+        self.audio_queue = asyncio.Queue(maxsize=SESSION_AUDIO_QUEUE_SIZE)
+        self.outbound_queue = asyncio.Queue(maxsize=SESSION_OUTBOUND_QUEUE_SIZE)
+        self.last_activity = time.monotonic()
+        self.draining = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.close_code = WS_CLOSE_NORMAL
+        self.dropped_audio = 0
+        self.dropped_messages = 0
+
+    def put_audio(self, chunk):
+        """Queue an audio chunk (None marks end of stream), dropping the oldest chunk on overflow."""
+        self.last_activity = time.monotonic()
+        if self.audio_queue.full():
+            self.audio_queue.get_nowait()
+            self.dropped_audio += 1
+            if self.dropped_audio % 50 == 1:
+                logger.warning(f"Session {self.id}: audio queue full, dropped {self.dropped_audio} chunks so far")
+        self.audio_queue.put_nowait(chunk)
+
+    async def send(self, message: dict, droppable: bool = False) -> bool:
+        """Queue a message for the client. Returns False if a droppable message was discarded."""
+        if droppable:
+            try:
+                self.outbound_queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped_messages += 1
+                return False
+            return True
+        await self.outbound_queue.put(message)
+        return True
+
+    async def write_outbound(self):
+        """Send queued messages to the client until the None sentinel is reached."""
+        while True:
+            message = await self.outbound_queue.get()
+            if message is None:
+                return
+            await self.websocket.send_json(message)
+
+    async def heartbeat(self):
+        """Send periodic heartbeats and return once the client has been idle too long."""
+        interval = min(SESSION_HEARTBEAT_INTERVAL, SESSION_IDLE_TIMEOUT)
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_activity > SESSION_IDLE_TIMEOUT:
+                logger.info(f"Session {self.id}: no audio for {SESSION_IDLE_TIMEOUT}s, closing")
+                return
+            await self.send({"type": "heartbeat"}, droppable=True)
+
+
+class TranscribeSessionManager:
+    """
+    Tracks live /ws/transcribe sessions.
+
+    New sessions are refused when the concurrent session limit is reached, when
+    event loop lag shows the process is overloaded, or while the server is draining.
+    """
+
+    def __init__(self, max_sessions: int = MAX_TRANSCRIBE_SESSIONS, max_loop_lag: float = SESSION_MAX_LOOP_LAG):
+        self.max_sessions = max_sessions
+        self.max_loop_lag = max_loop_lag
+        self.sessions: Dict[str, TranscribeSession] = {}
+        self.accepting = True
+        self.loop_lag = 0.0
+        self.monitor_task = None
+
+    def start(self):
+        if self.monitor_task is None:
+            self.monitor_task = asyncio.create_task(self._monitor_loop_lag())
+
+    async def _monitor_loop_lag(self, interval: float = 0.5):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, loop.time() - started - interval)
+
+    def admission_error(self):
+        """Return (close_code, reason) if a new session must be refused, otherwise None."""
+        if not self.accepting:
+            return WS_CLOSE_GOING_AWAY, "Server is shutting down"
+        if len(self.sessions) >= self.max_sessions:
+            return WS_CLOSE_TRY_AGAIN_LATER, "Too many active sessions"
+        if self.loop_lag > self.max_loop_lag:
+            return WS_CLOSE_TRY_AGAIN_LATER, "Server is overloaded"
+        return None
+
+    def register(self, session: TranscribeSession):
+        self.sessions[session.id] = session
+
+    def release(self, session: TranscribeSession):
+        self.sessions.pop(session.id, None)
+        session.closed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "accepting": self.accepting,
+            "loop_lag": round(self.loop_lag, 4)
+        }
+
+    async def drain(self, timeout: float = SESSION_DRAIN_TIMEOUT):
+        """Stop accepting sessions and let in-flight ones finish and save their transcripts."""
+        self.accepting = False
+        sessions = list(self.sessions.values())
+        if not sessions:
+            return
+
+        logger.info(f"Draining {len(sessions)} transcription sessions")
+        for session in sessions:
+            session.draining.set()
+
+        # Each session bounds its drain and flush by one SESSION_DRAIN_TIMEOUT deadline;
+        # leave room on top of that for the DynamoDB save
+        waiters = [session.closed.wait() for session in sessions]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout + 5)
+        except asyncio.TimeoutError:
+            remaining = list(self.sessions.values())
+            logger.warning(f"{len(remaining)} sessions did not drain in time, cancelling")
+            for session in remaining:
+                if session.task is not None:
+                    session.task.cancel()
+            # Cancellation still runs each handler's finally block, which saves the transcript
+            await asyncio.gather(*[session.closed.wait() for session in remaining])
+        logger.info("All transcription sessions drained")
+
+
+session_manager = TranscribeSessionManager()
+
+@app.on_event("startup")
+async def start_session_manager():
+    session_manager.start()
+
+@app.on_event("shutdown")
+async def drain_sessions():
+    await session_manager.drain()
+
 # WebSocket endpoint for real-time transcription
 @app.websocket("/ws/transcribe")
 async def websocket_transcribe(websocket: WebSocket):
     await websocket.accept()
-    logger.info("WebSocket connection accepted")
-    
+
+    # Refuse with a close code the client can act on rather than an HTTP error
+    refusal = session_manager.admission_error()
+    if refusal:
+        code, reason = refusal
+        logger.warning(f"Refused transcription session: {reason}")
+        await websocket.close(code=code, reason=reason)
+        return
+
+    transcribe_session = TranscribeSession(websocket)
+    session_manager.register(transcribe_session)
+    logger.info(f"WebSocket connection accepted (session {transcribe_session.id})")
+
+    # Clients opt into delta-encoded partials with ?protocol=2
+    try:
+        protocol_version = int(websocket.query_params.get('protocol', '1'))
+    except ValueError:
+        protocol_version = 1
+    protocol_version = min(max(protocol_version, 1), TRANSCRIPT_PROTOCOL_VERSION)
+    task_prefix = f"session-{transcribe_session.id}"
+    transcript_sender = PartialTranscriptCoalescer(transcribe_session.send, protocol_version, name=task_prefix)
+    speculator = SpeculativeAssistance(name=task_prefix)
+
     # Create unique conversation ID
-    conversation_id = str(uuid.uuid4())
-    conversation_data = {
-        "id": conversation_id,
-        "timestamp": datetime.now().isoformat(),
-        "transcript": []
-    }
+    conversation_id = transcribe_session.id
+    conversation_data = transcribe_session.conversation_data
+    tasks = []
+
+    profiler = None
 
     try:
+        # Admins can profile a whole session with the X-Profile header
+        if websocket.headers.get('x-profile') == 'true' and is_admin_token(websocket.headers.get('x-admin-token')):
+            profiler = StackSampler()
+            profiler.start()
+
         # Create a presigned URL for the transcribe streaming API
         aws_session = session  # Use the global boto3 session
         transcribe_client = aws_session.client('transcribe')
@@ -408,18 +899,35 @@ async def websocket_transcribe(websocket: WebSocket):
         
         # Create a connection to AWS Transcribe streaming service
         async with aiohttp.ClientSession() as http_session:  # Renamed to http_session
-            async with http_session.ws_connect(presigned_url) as aws_ws:
+            async with http_session.ws_connect(presigned_url, heartbeat=SESSION_HEARTBEAT_INTERVAL) as aws_ws:
                 logger.info("Connected to AWS Transcribe streaming service")
                 
-                # Start two tasks: one for receiving audio from client and sending to AWS,
-                # and another for receiving transcription from AWS and sending to client
+                # Audio flows client -> audio queue -> AWS, and results flow
+                # AWS -> outbound queue -> client, so neither side can block the other
+                
+                # Task 1: Receive audio from client into the bounded audio queue
+                async def read_audio():
+                    try:
+                        while True:
+                            message = await websocket.receive()
+                            if message["type"] == "websocket.disconnect":
+                                return
+                            if message.get("bytes"):
+                                transcribe_session.put_audio(message["bytes"])
+                    except Exception as e:
+                        logger.error(f"Error in read_audio: {str(e)}")
+                        logger.error(traceback.format_exc())
                 
-                # Task 1: Receive audio from client and send to AWS
+                # Task 2: Forward queued audio to AWS
                 async def forward_audio():
                     try:
                         while True:
-                            # Process audio data
-                            audio_data = await websocket.receive_bytes()
+                            audio_data = await transcribe_session.audio_queue.get()
+                            
+                            # An empty audio event tells Transcribe the stream has ended
+                            if audio_data is None:
+                                await aws_ws.send_json({"audio_event": {"audio_chunk": ""}})
+                                return
                             
                             # Create the event message for AWS Transcribe
                             message = {
@@ -433,7 +941,7 @@ async def websocket_transcribe(websocket: WebSocket):
                         logger.error(f"Error in forward_audio: {str(e)}")
                         logger.error(traceback.format_exc())
                 
-                # Task 2: Receive transcription from AWS and send to client
+                # Task 3: Receive transcription from AWS and queue it for the client
                 async def receive_transcription():
                     try:
                         async for msg in aws_ws:
@@ -451,28 +959,24 @@ async def websocket_transcribe(websocket: WebSocket):
                                             is_final = not result.get('IsPartial', True)
 
                                             if transcript.strip():
-                                                # Send transcript to client (both partial and final)
-                                                await websocket.send_json({
-                                                    "type": "transcript",
-                                                    "data": {
-                                                        "text": transcript,
-                                                        "is_final": is_final
-                                                    }
-                                                })
-                                                logger.info(f"Sent transcript (is_final={is_final}): {transcript}")
+                                                # Send transcript to client (partials are coalesced)
+                                                await transcript_sender.add(transcript, is_final)
 
-                                                if is_final:
+                                                if not is_final:
+                                                    speculator.observe_partial(transcript)
+                                                else:
                                                     # Save to conversation data
                                                     conversation_data["transcript"].append({
                                                         "text": transcript,
                                                         "timestamp": datetime.now().isoformat()
                                                     })
                                                     
-                                                    # Get AI assistance
-                                                    assistance_text = await get_bedrock_assistance(transcript)
+                                                    # Get AI assistance, reusing speculative retrieval when it matches
+                                                    prepared = await speculator.take(transcript)
+                                                    assistance_text = await get_bedrock_assistance(transcript, **prepared)
                                                     
                                                     # Send assistance to client
-                                                    await websocket.send_json({
+                                                    await transcribe_session.send({
                                                         "type": "assistance",
                                                         "data": {
                                                             "suggestion": assistance_text
@@ -483,11 +987,57 @@ async def websocket_transcribe(websocket: WebSocket):
                         logger.error(f"Error in receive_transcription: {str(e)}")
                         logger.error(traceback.format_exc())
                 
-                # Run both tasks concurrently
-                await asyncio.gather(
-                    forward_audio(),
-                    receive_transcription()
+                # Task 4: Send queued messages to the client
+                async def write_outbound():
+                    try:
+                        await transcribe_session.write_outbound()
+                    except Exception as e:
+                        logger.error(f"Error in write_outbound: {str(e)}")
+                
+                reader = asyncio.create_task(read_audio(), name=f"{task_prefix}:read_audio")
+                forwarder = asyncio.create_task(forward_audio(), name=f"{task_prefix}:forward_audio")
+                receiver = asyncio.create_task(receive_transcription(), name=f"{task_prefix}:receive_transcription")
+                writer = asyncio.create_task(write_outbound(), name=f"{task_prefix}:write_outbound")
+                heartbeat = asyncio.create_task(transcribe_session.heartbeat(), name=f"{task_prefix}:heartbeat")
+                drain_requested = asyncio.create_task(transcribe_session.draining.wait(), name=f"{task_prefix}:drain")
+                tasks = [reader, forwarder, receiver, writer, heartbeat, drain_requested]
+                
+                # Run until the client leaves, the upstream stream ends, the session
+                # goes idle or the server asks in-flight sessions to drain
+                await asyncio.wait(
+                    [reader, receiver, writer, heartbeat, drain_requested],
+                    return_when=asyncio.FIRST_COMPLETED
                 )
+                
+                client_connected = not reader.done()
+                
+                # Draining the upstream and flushing the client share one deadline
+                loop = asyncio.get_running_loop()
+                drain_deadline = loop.time() + SESSION_DRAIN_TIMEOUT
+                
+                if drain_requested.done():
+                    # Stop taking audio, let Transcribe finalize what it has and
+                    # deliver the remaining results before closing
+                    transcribe_session.close_code = WS_CLOSE_GOING_AWAY
+                    reader.cancel()
+                    transcribe_session.put_audio(None)
+                    try:
+                        await asyncio.wait_for(asyncio.shield(receiver), max(0.0, drain_deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Session {transcribe_session.id}: Transcribe did not finish within drain timeout")
+                
+                # Skip the flush if the writer already failed; nothing would read the queue
+                if client_connected and not writer.done():
+                    # Flush queued transcripts and assistance before closing
+                    async def flush_outbound():
+                        await transcribe_session.send(None)
+                        await writer
+                    
+                    transcript_sender.close()
+                    try:
+                        await asyncio.wait_for(flush_outbound(), max(0.0, drain_deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Session {transcribe_session.id}: could not flush outbound messages in time")
 
     except Exception as e:
         error_msg = f"Transcription error: {str(e)}"
@@ -498,6 +1048,11 @@ async def websocket_transcribe(websocket: WebSocket):
         except:
             pass
     finally:
+        for task in tasks:
+            task.cancel()
+        transcript_sender.close()
+        speculator.close()
+
         # Save conversation to DynamoDB
         try:
             if conversation_data["transcript"]:
@@ -509,55 +1064,63 @@ async def websocket_transcribe(websocket: WebSocket):
                 logger.info(f"Saved conversation {conversation_id} to DynamoDB")
         except Exception as e:
             logger.error(f"Error saving to DynamoDB: {str(e)}")
+        session_manager.release(transcribe_session)
+        if profiler is not None:
+            profile_id = store_profile(await asyncio.to_thread(profiler.stop), f"{task_prefix}-profile")
+            logger.info(f"Stored session profile {profile_id}")
+        logger.info(f"Session {transcribe_session.id} closed (dropped {transcribe_session.dropped_audio} audio chunks, {transcribe_session.dropped_messages} messages)")
 
         # Cleanup
-        await websocket.close()
+        try:
+            await websocket.close(code=transcribe_session.close_code)
+        except Exception:
+            pass
 
-async def get_bedrock_assistance(user_message: str) -> str:
+async def fetch_assistance_context() -> str:
     """
-    Queries the S3 knowledge base, invokes Bedrock, and returns assistance.
+    Fetches the S3 knowledge base documents used as context for assistance.
     """
-    try:
-        # Get relevant documents from S3 knowledge base
-        def get_s3_docs():
-            response = s3_client.list_objects_v2(
-                Bucket=BUCKET_NAME,
-                Prefix=KNOWLEDGE_BASE_PREFIX
-            )
+    # Get relevant documents from S3 knowledge base
+    def get_s3_docs():
+        response = s3_client.list_objects_v2(
+            Bucket=BUCKET_NAME,
+            Prefix=KNOWLEDGE_BASE_PREFIX
+        )
             
-            context_docs = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    if obj['Key'] == KNOWLEDGE_BASE_PREFIX:
-                        continue
+        context_docs = []
+        if 'Contents' in response:
+            for obj in response['Contents']:
+                if obj['Key'] == KNOWLEDGE_BASE_PREFIX:
+                    continue
                     
-                    doc_response = s3_client.get_object(
-                        Bucket=BUCKET_NAME,
-                        Key=obj['Key']
-                    )
-                    doc_content = doc_response['Body'].read()
+                doc_response = s3_client.get_object(
+                    Bucket=BUCKET_NAME,
+                    Key=obj['Key']
+                )
+                doc_content = doc_response['Body'].read()
                     
-                    if obj['Key'].lower().endswith('.pdf'):
-                        doc_text = extract_text_from_pdf(doc_content)
-                    else:
-                        try:
-                            doc_text = doc_content.decode('utf-8')
-                        except UnicodeDecodeError:
-                            logger.warning(f"Could not decode file as text: {obj['Key']}")
-                            continue
+                if obj['Key'].lower().endswith('.pdf'):
+                    doc_text = extract_text_from_pdf(doc_content)
+                else:
+                    try:
+                        doc_text = doc_content.decode('utf-8')
+                    except UnicodeDecodeError:
+                        logger.warning(f"Could not decode file as text: {obj['Key']}")
+                        continue
                     
-                    if doc_text.strip():
-                        context_docs.append(doc_text)
-            return context_docs
+                if doc_text.strip():
+                    context_docs.append(doc_text)
+        return context_docs
 
-        context_docs = await asyncio.to_thread(get_s3_docs)
-        
-        context = "\n\n".join(context_docs)
-        
-        if not context.strip():
-            return "I apologize, but I couldn't find any readable documents in the knowledge base to help answer your question."
+    context_docs = await asyncio.to_thread(get_s3_docs)
+    
+    return "\n\n".join(context_docs)
 
-        prompt = f"""You are a helpful AI assistant. Use the following context to answer the question.
+def build_assistance_prompt(context: str, user_message: str) -> str:
+    """
+    Builds the Bedrock prompt for a question and its knowledge base context.
+    """
+    return f"""You are a helpful AI assistant. Use the following context to answer the question.
         If you cannot find the answer in the context, say so.
 
         Context:
@@ -567,6 +1130,21 @@ async def get_bedrock_assistance(user_message: str) -> str:
 
         Answer:"""
 
+async def get_bedrock_assistance(user_message: str, context: str = None, prompt: str = None) -> str:
+    """
+    Queries the S3 knowledge base, invokes Bedrock, and returns assistance.
+    A context or prompt prepared ahead of time (see SpeculativeAssistance) is used as-is.
+    """
+    try:
+        if context is None:
+            context = await fetch_assistance_context()
+        
+        if not context.strip():
+            return "I apologize, but I couldn't find any readable documents in the knowledge base to help answer your question."
+
+        if prompt is None:
+            prompt = build_assistance_prompt(context, user_message)
+
         request_payload = {
             "inputText": prompt,
             "textGenerationConfig": {
@@ -677,6 +1255,272 @@ async def debug_config():
         "s3_bucket": BUCKET_NAME
     }
 
+@app.get("/api/debug/speculation")
+async def debug_speculation():
+    """Debug endpoint to report speculative assistance hit rate and time saved"""
+    resolved = speculation_stats["hits"] + speculation_stats["misses"]
+    return {
+        "enabled": SPECULATIVE_ASSISTANCE,
+        **speculation_stats,
+        "hit_rate": speculation_stats["hits"] / resolved if resolved else None,
+        "avg_time_saved_ms": speculation_stats["time_saved"] * 1000 / speculation_stats["hits"] if speculation_stats["hits"] else None,
+        "prompt_hit_rate": speculation_stats["prompt_hits"] / speculation_stats["hits"] if speculation_stats["hits"] else None
+    }
+
+# Profiling hooks, only reachable with PROFILING_ENABLED=true and the admin token
+class StackSampler:
+    """
+    Sampling profiler. A background thread records the stack of every other thread
+    each interval and aggregates them as collapsed stacks ("frame;frame;frame count"),
+    the input format of flamegraph.pl and speedscope. Nothing runs while stopped, and
+    sampling stops by itself after PROFILING_MAX_SECONDS.
+    """
+
+    def __init__(self, interval_ms: float = PROFILING_SAMPLE_INTERVAL_MS, max_seconds: float = PROFILING_MAX_SECONDS):
+        # Never spin: a zero or negative interval would starve the event loop
+        self.interval = max(interval_ms, 1.0) / 1000
+        self.max_seconds = max_seconds
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> str:
+        self.stop_event.set()
+        self.thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self.stop_event.wait(self.interval):
+            if time.monotonic() > deadline:
+                logger.warning(f"Profiler stopped after reaching {self.max_seconds}s limit")
+                return
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.counts.items())) + "\n"
+
+
+active_sampler = None
+stored_profiles = OrderedDict()
+
+def is_admin_token(token: str) -> bool:
+    if not PROFILING_ENABLED or not PROFILING_ADMIN_TOKEN or not token:
+        return False
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str, and headers are latin-1
+    return hmac.compare_digest(token.encode('utf-8'), PROFILING_ADMIN_TOKEN.encode('utf-8'))
+
+async def require_admin(x_admin_token: str = Header(None)):
+    # Hide the endpoints entirely unless profiling is switched on
+    if not PROFILING_ENABLED or not PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def store_profile(collapsed: str, profile_id: str = None) -> str:
+    profile_id = profile_id or f"profile-{uuid.uuid4()}"
+    stored_profiles[profile_id] = collapsed
+    while len(stored_profiles) > PROFILING_MAX_STORED:
+        stored_profiles.popitem(last=False)
+    return profile_id
+
+def profile_response(profile_id: str, collapsed: str) -> PlainTextResponse:
+    return PlainTextResponse(collapsed, headers={
+        "Content-Disposition": f'attachment; filename="{profile_id}.folded"',
+        "X-Profile-Id": profile_id
+    })
+
+if PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        """Profiles a single request sent with `X-Profile: true` and the admin token."""
+        if request.headers.get('x-profile') != 'true' or not is_admin_token(request.headers.get('x-admin-token')):
+            return await call_next(request)
+
+        # The sampler sees the whole process, so concurrent requests show up too
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            collapsed = await asyncio.to_thread(sampler.stop)
+            profile_id = store_profile(collapsed)
+            logger.info(f"Stored request profile {profile_id} for {request.url.path} ({sampler.samples} samples)")
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+@app.post("/api/admin/profile/start", dependencies=[Depends(require_admin)])
+async def start_profile(interval_ms: float = PROFILING_SAMPLE_INTERVAL_MS):
+    """Start the process-wide sampling profiler"""
+    global active_sampler
+    if active_sampler is not None:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    active_sampler = StackSampler(interval_ms=interval_ms)
+    active_sampler.start()
+    return {"message": "Profiler started", "interval_ms": active_sampler.interval * 1000, "max_seconds": PROFILING_MAX_SECONDS}
+
+@app.post("/api/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_profile():
+    """Stop the sampling profiler and return collapsed stacks"""
+    global active_sampler
+    if active_sampler is None:
+        raise HTTPException(status_code=409, detail="Profiler is not running")
+    sampler, active_sampler = active_sampler, None
+    collapsed = await asyncio.to_thread(sampler.stop)
+    profile_id = store_profile(collapsed)
+    return profile_response(profile_id, collapsed)
+
+@app.get("/api/admin/profile/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Download a stored profile (per-request and per-session profiles are kept here)"""
+    if profile_id not in stored_profiles:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile_response(profile_id, stored_profiles[profile_id])
+
+def describe_await_chain(coro) -> List[str]:
+    """Follow a coroutine's await chain down to the innermost pending await."""
+    chain = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            chain.append(type(coro).__name__)
+            break
+        chain.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return chain
+
+def describe_task(task: asyncio.Task) -> Dict[str, Any]:
+    return {
+        "name": task.get_name(),
+        "done": task.done(),
+        "awaiting": describe_await_chain(task.get_coro())
+    }
+
+def describe_session(transcribe_session: TranscribeSession) -> Dict[str, Any]:
+    transcript = transcribe_session.conversation_data["transcript"]
+    now = time.monotonic()
+    return {
+        "id": transcribe_session.id,
+        "age": round(now - transcribe_session.started_at, 1),
+        "idle": round(now - transcribe_session.last_activity, 1),
+        "draining": transcribe_session.draining.is_set(),
+        "audio_queue": transcribe_session.audio_queue.qsize(),
+        "outbound_queue": transcribe_session.outbound_queue.qsize(),
+        "dropped_audio": transcribe_session.dropped_audio,
+        "dropped_messages": transcribe_session.dropped_messages,
+        "transcript_entries": len(transcript),
+        "transcript_bytes": sum(len(entry["text"].encode('utf-8')) for entry in transcript)
+    }
+
+@app.get("/api/admin/tasks", dependencies=[Depends(require_admin)])
+async def dump_tasks():
+    """Dump every live asyncio task, grouped by transcription session"""
+    tasks = asyncio.all_tasks()
+    sessions = []
+    for transcribe_session in list(session_manager.sessions.values()):
+        prefix = f"session-{transcribe_session.id}:"
+        owned = [task for task in tasks if task is transcribe_session.task or task.get_name().startswith(prefix)]
+        tasks.difference_update(owned)
+        sessions.append({
+            **describe_session(transcribe_session),
+            "tasks": [describe_task(task) for task in owned]
+        })
+    return {
+        **session_manager.stats(),
+        "sessions": sessions,
+        "other_tasks": [describe_task(task) for task in tasks]
+    }
+
+last_snapshot = None
+
+@app.post("/api/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def start_tracemalloc(frames: int = 10):
+    """Start tracing allocations; this has a real cost until stopped"""
+    global last_snapshot
+    if tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is already tracing")
+    if frames < 1:
+        raise HTTPException(status_code=400, detail="frames must be at least 1")
+    try:
+        tracemalloc.start(frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    last_snapshot = None
+    return {"message": "tracemalloc started", "frames": frames}
+
+@app.post("/api/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def stop_tracemalloc():
+    """Stop tracing allocations and drop the stored snapshot"""
+    global last_snapshot
+    tracemalloc.stop()
+    last_snapshot = None
+    return {"message": "tracemalloc stopped"}
+
+@app.get("/api/admin/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def tracemalloc_snapshot(limit: int = 25, key_type: str = "lineno", filename: str = None):
+    """
+    Take a snapshot and return the top allocation sites and the growth since the
+    previous snapshot. `filename` narrows the report, e.g. to main.py.
+    """
+    global last_snapshot
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not tracing")
+    if key_type not in ("lineno", "traceback", "filename"):
+        raise HTTPException(status_code=400, detail="key_type must be lineno, traceback or filename")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>")
+    ]
+    if filename:
+        filters.append(tracemalloc.Filter(True, f"*{filename}"))
+    # Keep the raw snapshot as the baseline and filter both sides, so growth stays
+    # correct when `filename` changes between calls
+    raw_snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+    snapshot = raw_snapshot.filter_traces(filters)
+
+    def format_stat(stat):
+        return {
+            "location": [str(frame) for frame in stat.traceback.format()] if key_type == "traceback" else str(stat.traceback[0]),
+            "size": stat.size,
+            "count": stat.count,
+            "size_diff": getattr(stat, "size_diff", None)
+        }
+
+    top = snapshot.statistics(key_type)[:limit]
+    growth = snapshot.compare_to(last_snapshot.filter_traces(filters), key_type)[:limit] if last_snapshot is not None else []
+    last_snapshot = raw_snapshot
+    current, peak = tracemalloc.get_traced_memory()
+
+    return {
+        "traced_current": current,
+        "traced_peak": peak,
+        "top": [format_stat(stat) for stat in top],
+        "growth_since_last": [format_stat(stat) for stat in growth],
+        "sessions": [describe_session(s) for s in list(session_manager.sessions.values())]
+    }
+
 @app.get("/api/knowledge-base")
 async def list_knowledge_base():
     """List all documents in the knowledge base"""
@@ -736,6 +1580,15 @@ async def list_knowledge_base():
 
 if __name__ == "__main__":
     import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        """Drains transcription sessions before uvicorn closes open websockets."""
+
+        async def shutdown(self, sockets=None):
+            await session_manager.drain()
+            await super().shutdown(sockets=sockets)
+
     port = int(os.getenv('PORT', 8000))
     host = os.getenv('HOST', '0.0.0.0')
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    config = uvicorn.Config(app, host=host, port=port, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
+    DrainingServer(config).run()
\ No newline at end of file
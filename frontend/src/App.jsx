@@ -9,6 +9,7 @@ import DataManager from './pages/DataManager';
 import { Toaster } from 'sonner';
 import { AudioStreamProvider } from './context/AudioStreamContext';
 import CallAssistant from './components/CallAssistant';
+import { TRANSCRIPT_PROTOCOL_VERSION } from './lib/transcript';
 
 function App() {
   return (
@@ -23,7 +24,7 @@ function App() {
             <Route path="/data-manager" element={<DataManager />} />
           </Routes>
           <div className="fixed bottom-4 right-4">
-            <CallAssistant />
+            <CallAssistant protocolVersion={TRANSCRIPT_PROTOCOL_VERSION} />
           </div>
         </Layout>
       </AudioStreamProvider>
@@ -3,7 +3,7 @@ import { useAudioStream } from '../context/AudioStreamContext';
 import { Button } from './ui/Button';
 import { Card, CardContent, CardHeader, CardTitle } from './ui/Card';
 
-const CallAssistant = () => {
+const CallAssistant = ({ protocolVersion = 1 }) => {
   const {
     connectionStatus,
     liveTranscript,
@@ -22,7 +22,7 @@ const CallAssistant = () => {
       </CardHeader>
       <CardContent className="space-y-4">
         <div className="flex items-center justify-between">
-          <Button onClick={isTranscribing ? stopAssistance : startAssistance}>
+          <Button onClick={isTranscribing ? stopAssistance : () => startAssistance(protocolVersion)}>
             {isTranscribing ? 'Stop Assistance' : 'Start Assistance'}
           </Button>
           <p className="text-sm text-gray-500">Status: {connectionStatus}</p>
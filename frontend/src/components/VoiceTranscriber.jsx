@@ -1,9 +1,11 @@
 import React, { useState, useRef, useEffect } from 'react';
-import { getWsBaseUrl } from '@/lib/api';
+import { getTranscribeWsUrl } from '@/lib/api';
+import { applyTranscriptDelta, emptyTranscriptState } from '@/lib/transcript';
 
-const VoiceTranscriber = () => {
+const VoiceTranscriber = ({ protocolVersion = 1 }) => {
   const [isRecording, setIsRecording] = useState(false);
   const [transcriptions, setTranscriptions] = useState([]);
+  const [interimText, setInterimText] = useState('');
   const [error, setError] = useState(null);
   const [currentSpeaker, setCurrentSpeaker] = useState('Customer');
   const [microphoneStatus, setMicrophoneStatus] = useState('off'); // 'off', 'pending', 'ready'
@@ -12,6 +14,7 @@ const VoiceTranscriber = () => {
   const streamRef = useRef(null);
   const processorRef = useRef(null);
   const inputStreamRef = useRef(null);
+  const partialRef = useRef(emptyTranscriptState());
 
   // Check microphone permissions on component mount
   useEffect(() => {
@@ -68,14 +71,15 @@ const VoiceTranscriber = () => {
     try {
       setError(null);
       setTranscriptions([]);
+      setInterimText('');
+      partialRef.current = emptyTranscriptState();
 
       // Initialize microphone
       const stream = await initializeMicrophone();
       streamRef.current = stream;
 
       // Initialize WebSocket
-      const wsBaseUrl = getWsBaseUrl();
-      websocketRef.current = new WebSocket(`${wsBaseUrl}/ws/transcribe`);
+      websocketRef.current = new WebSocket(getTranscribeWsUrl(protocolVersion));
       
       websocketRef.current.onmessage = (event) => {
         const data = JSON.parse(event.data);
@@ -85,6 +89,19 @@ const VoiceTranscriber = () => {
             text: data.text,
             timestamp: new Date().toLocaleTimeString()
           }]);
+        } else if (data.type === 'transcript_delta') {
+          partialRef.current = applyTranscriptDelta(partialRef.current, data.data);
+          if (data.data.is_final) {
+            const text = partialRef.current.text;
+            setTranscriptions(prev => [...prev, {
+              speaker: currentSpeaker,
+              text,
+              timestamp: new Date().toLocaleTimeString()
+            }]);
+            setInterimText('');
+          } else {
+            setInterimText(partialRef.current.text);
+          }
         } else if (data.type === 'error') {
           setError(data.message);
           stopRecording();
@@ -161,6 +178,7 @@ const VoiceTranscriber = () => {
       websocketRef.current = null;
     }
 
+    setInterimText('');
     setIsRecording(false);
   };
 
@@ -251,8 +269,9 @@ const VoiceTranscriber = () => {
           </div>
           
           <div className="space-y-4 max-h-[500px] overflow-y-auto">
-            {transcriptions.length > 0 ? (
-              transcriptions.map((item, index) => (
+            {transcriptions.length > 0 || interimText ? (
+              <>
+              {transcriptions.map((item, index) => (
                 <div 
                   key={index} 
                   className={`p-3 rounded-lg ${
@@ -273,7 +292,11 @@ const VoiceTranscriber = () => {
                   </div>
                   <p className="text-gray-700">{item.text}</p>
                 </div>
-              ))
+              ))}
+              {interimText && (
+                <p className="px-3 text-gray-400 italic">{interimText}</p>
+              )}
+              </>
             ) : (
               <div className="text-center py-8">
                 <p className="text-gray-500 italic">
@@ -1,4 +1,6 @@
 import React, { createContext, useState, useContext, useRef } from 'react';
+import { getTranscribeWsUrl } from '../lib/api';
+import { applyTranscriptDelta, emptyTranscriptState } from '../lib/transcript';
 
 const AudioStreamContext = createContext();
 
@@ -13,8 +15,9 @@ export const AudioStreamProvider = ({ children }) => {
   const audioContextRef = useRef(null);
   const websocketRef = useRef(null);
   const audioStreamRef = useRef(null);
+  const partialRef = useRef(emptyTranscriptState());
 
-  const startAssistance = async () => {
+  const startAssistance = async (protocolVersion = 1) => {
     setConnectionStatus('connecting');
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
@@ -28,8 +31,9 @@ export const AudioStreamProvider = ({ children }) => {
       await audioContext.audioWorklet.addModule('/audio-processor.js');
       const workletNode = new AudioWorkletNode(audioContext, 'audio-processor');
 
-      const socket = new WebSocket('ws://localhost:8000/ws/transcribe');
+      const socket = new WebSocket(getTranscribeWsUrl(protocolVersion));
       websocketRef.current = socket;
+      partialRef.current = emptyTranscriptState();
 
       socket.onopen = () => {
         setConnectionStatus('connected');
@@ -46,6 +50,15 @@ export const AudioStreamProvider = ({ children }) => {
           } else {
             setLiveTranscript(message.text);
           }
+        } else if (message.type === 'transcript_delta') {
+          partialRef.current = applyTranscriptDelta(partialRef.current, message.data);
+          if (message.data.is_final) {
+            const text = partialRef.current.text;
+            setFinalTranscript(prev => prev + text + ' ');
+            setLiveTranscript('');
+          } else {
+            setLiveTranscript(partialRef.current.text);
+          }
         } else if (message.type === 'assistance') {
           setAssistance(message.content);
         }
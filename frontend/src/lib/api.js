@@ -24,6 +24,12 @@ const getWsBaseUrl = () => {
   return 'ws://localhost:8000';
 };
 
+// Build the live transcription websocket URL; protocol 2 opts into delta-encoded partials
+const getTranscribeWsUrl = (protocolVersion = 1) => {
+  const url = `${getWsBaseUrl()}/ws/transcribe`;
+  return protocolVersion > 1 ? `${url}?protocol=${protocolVersion}` : url;
+};
+
 // Helper function to create full API URLs
 const createApiUrl = (endpoint) => {
   // In development, use relative paths (handled by Vite proxy)
@@ -34,4 +40,4 @@ const createApiUrl = (endpoint) => {
   return `${getApiBaseUrl()}${endpoint}`;
 };
 
-export { getApiBaseUrl, getWsBaseUrl, createApiUrl };
+export { getApiBaseUrl, getWsBaseUrl, getTranscribeWsUrl, createApiUrl };
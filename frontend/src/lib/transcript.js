@@ -0,0 +1,22 @@
+// Live transcript protocol helpers for /ws/transcribe
+// Pass as `protocolVersion` to opt a component into delta-encoded partials
+export const TRANSCRIPT_PROTOCOL_VERSION = 2;
+
+// Apply a `transcript_delta` message to the text of the current segment.
+// Returns the updated state; deltas for an older segment or revision are ignored.
+export const applyTranscriptDelta = (state, delta) => {
+  if (delta.segment < state.segment) {
+    return state;
+  }
+  if (delta.segment === state.segment && delta.revision <= state.revision) {
+    return state;
+  }
+  const base = delta.segment === state.segment ? state.text : '';
+  return {
+    segment: delta.segment,
+    revision: delta.revision,
+    text: base.slice(0, delta.offset) + delta.text,
+  };
+};
+
+export const emptyTranscriptState = () => ({ segment: 0, revision: 0, text: '' });